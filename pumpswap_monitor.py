@@ -6,26 +6,34 @@ Channel 2: periodically checks DB tokens against DexScreener filter criteria
            /status command → lists tokens currently passing the filter
 
 Setup:
-  1. pip install requests websocket-client psycopg2-binary python-dotenv
+  1. pip install requests websocket-client psycopg2-binary python-dotenv orjson
   2. Create bot via @BotFather → get token
   3. Get chat_ids via https://api.telegram.org/bot<TOKEN>/getUpdates
-  4. Create NeonDB project → copy connection string
+  4. Create NeonDB project → copy the pooled (-pooler) connection string
   5. Fill in .env
   6. python3 pumpswap_monitor.py
 """
 
-import json
+import csv
+import io
 import os
+import queue
 import re
 import threading
 import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import websocket
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from dotenv import load_dotenv
 
 # ─── LOAD CONFIG FROM .env ────────────────────────────────────────────────────
@@ -38,6 +46,17 @@ CHAT_ID             = os.getenv("CHAT_ID", "")
 DATABASE_URL        = os.getenv("DATABASE_URL", "")
 
 FILTER_POLL_SEC = int(os.getenv("FILTER_POLL_SEC", 90))
+CLEANUP_INTERVAL_SEC = 3600
+FETCH_WORKERS   = int(os.getenv("FETCH_WORKERS", 8))
+META_WORKERS    = int(os.getenv("META_WORKERS", 4))
+COPY_MIN_ROWS   = 500   # above this, filter_state inserts go through COPY
+# How long a mint's DexScreener result is reused: above half of FILTER_POLL_SEC
+# so the staggered F2/F3 loops share each other's fetches, but below the full
+# interval so each loop still sees fresh data every cycle
+PAIRS_CACHE_TTL = min(float(os.getenv("PAIRS_CACHE_TTL", FILTER_POLL_SEC * 2 / 3)),
+                      FILTER_POLL_SEC * 0.9)
+TG_POLL_TIMEOUT = int(os.getenv("TG_POLL_TIMEOUT", 25))
+TG_429_RETRIES  = 5     # sendMessage retries after a 429, each after retry_after
 
 # ── Filter 2: MCap $200K-$1M ──────────────────────────────────────────────────
 F2 = {
@@ -65,25 +84,93 @@ F3 = {
 
 PUMPPORTAL_WS    = "wss://pumpportal.fun/api/data"
 DEXSCREENER_API  = "https://api.dexscreener.com/latest/dex/tokens/{}"
+DEXSCREENER_BATCH = 30   # max addresses per /tokens request (API limit)
+# /latest/dex/tokens allows 300 req/min; stay under it across batch and meta fetches
+DEXSCREENER_RPM   = int(os.getenv("DEXSCREENER_RPM", 240))
+DEXSCREENER_BURST = 10
 TELEGRAM_API_NEW = f"https://api.telegram.org/bot{BOT_TOKEN_NEW_PAIRS}"
 TELEGRAM_API_F2  = f"https://api.telegram.org/bot{BOT_TOKEN_FILTER2}"
 TELEGRAM_API_F3  = f"https://api.telegram.org/bot{BOT_TOKEN_FILTER3}"
 
+HEADERS = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
+JSON_BODY = {"Content-Type": "application/json"}   # for pre-serialized orjson bodies
+HTML_TAG_RE = re.compile(r"<[^>]+>")   # strips markup for the plain-text resend
+
+# Shared HTTP session — keeps TCP/TLS connections to DexScreener and Telegram
+# alive between calls instead of handshaking on every request
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+_adapter = HTTPAdapter(
+    pool_connections=4,           # host pools kept; we only talk to two hosts
+    pool_maxsize=32,              # per host: fetch/meta workers, pollers, senders
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False),
+)
+SESSION.mount("https://api.dexscreener.com", _adapter)
+SESSION.mount("https://api.telegram.org", _adapter)
+
+# DexScreener batch fetches, shared by the filter loops and commands
+fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+# Alert sends overlap each other instead of queueing behind one another
+tg_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tg")
+
 # Shared in-memory state
 lock                 = threading.Lock()
-seen_tokens_set: set = set()   # fast lookup, loaded from DB on startup
+# seen_tokens_set is immutable once published: writers build a new frozenset
+# under `lock` and rebind the name; readers just grab the current reference
+seen_tokens_set: frozenset = frozenset()   # fast lookup, loaded from DB on startup
 filter_state: dict   = {}
 update_offsets: dict = {"f2": 0, "f3": 0, "new": 0}
+db_pool = None                 # psycopg2 ThreadedConnectionPool, set in init_db()
+pairs_cache: dict    = {}      # mint -> (fetched_at, [pairs]) for fetch_token_data
+pairs_cache_lock     = threading.Lock()
+graduation_queue     = queue.Queue()   # (mint, ws event) awaiting meta fetch + alert
+dex_bucket: dict     = {"tokens": DEXSCREENER_BURST, "at": time.monotonic()}
+dex_bucket_lock      = threading.Lock()
 
 
 # ─── DATABASE ─────────────────────────────────────────────────────────────────
 
+def checkout_conn():
+    """Take a live connection from the pool. Neon's idle-suspend kills every
+    idle connection at once, so keep discarding dead ones; the idle list holds
+    at most maxconn, after which getconn opens a fresh connection."""
+    for _ in range(db_pool.maxconn):
+        conn = db_pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            db_pool.putconn(conn, close=True)
+    return db_pool.getconn()
+
+
+@contextmanager
 def get_conn():
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+    """Borrow a pooled connection; commits on success, rolls back on error."""
+    conn = checkout_conn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        db_pool.putconn(conn)
 
 
 def init_db():
-    """Create tables if they don't exist."""
+    """Open the connection pool and create tables if they don't exist."""
+    global db_pool
+    # psycopg2 keeps only minconn idle connections and closes the rest on
+    # putconn, so keep one per concurrent DB user: graduation workers, both
+    # filter loops and cleanup; the extra headroom covers startup/commands
+    db_min = META_WORKERS + 3
+    db_pool = psycopg2.pool.ThreadedConnectionPool(
+        db_min, db_min + 3, DATABASE_URL,
+        sslmode="require", connect_timeout=10,
+        keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3,
+    )
     with get_conn() as conn:
         with conn.cursor() as cur:
             # All graduated token addresses
@@ -103,6 +190,11 @@ def init_db():
                     PRIMARY KEY (filter_key, address)
                 )
             """)
+            # Cleanup deletes by age; rows with created_at_ms = 0 are never deleted
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS seen_tokens_created_idx
+                ON seen_tokens (created_at_ms) WHERE created_at_ms > 0
+            """)
         conn.commit()
     print("  [DB] Tables ready.")
 
@@ -114,7 +206,9 @@ def db_load_seen_tokens() -> set:
             return {row[0] for row in cur.fetchall()}
 
 
-def db_add_seen_token(address: str, created_at_ms: int = 0):
+def db_add_seen_token(address: str, created_at_ms: int = 0) -> bool:
+    """Insert a token; False if the DB already had it. Errors count as new
+    so a DB hiccup never swallows an alert."""
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
@@ -122,10 +216,14 @@ def db_add_seen_token(address: str, created_at_ms: int = 0):
                     INSERT INTO seen_tokens (address, created_at_ms)
                     VALUES (%s, %s)
                     ON CONFLICT DO NOTHING
+                    RETURNING address
                 """, (address, created_at_ms))
+                inserted = cur.fetchone() is not None
             conn.commit()
+        return inserted
     except Exception as e:
         print(f"  [DB] db_add_seen_token error: {e}")
+        return True
 
 
 def db_load_filter_state(filter_key: str, state_type: str) -> set:
@@ -139,6 +237,23 @@ def db_load_filter_state(filter_key: str, state_type: str) -> set:
             return {row[0] for row in cur.fetchall()}
 
 
+def copy_filter_state_rows(cur, rows: list, update: bool = False):
+    """Bulk-insert (filter_key, address, state) rows: COPY into a temp table,
+    then merge. Existing keys are skipped (ON CONFLICT DO NOTHING), or have
+    their state overwritten when update=True."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.execute("CREATE TEMP TABLE filter_state_in (LIKE filter_state) ON COMMIT DROP")
+    cur.copy_expert("COPY filter_state_in (filter_key, address, state) FROM STDIN WITH CSV", buf)
+    action = "UPDATE SET state = EXCLUDED.state" if update else "NOTHING"
+    cur.execute(f"""
+        INSERT INTO filter_state (filter_key, address, state)
+        SELECT filter_key, address, state FROM filter_state_in
+        ON CONFLICT (filter_key, address) DO {action}
+    """)
+
+
 def db_save_filter_state(filter_key: str, state_type: str, addresses: set):
     """Replace the filter state set in DB."""
     if not addresses:
@@ -152,18 +267,69 @@ def db_save_filter_state(filter_key: str, state_type: str, addresses: set):
                     WHERE filter_key = %s AND state = %s
                 """, (filter_key, state_type))
                 # Insert new
-                psycopg2.extras.execute_values(
-                    cur,
-                    "INSERT INTO filter_state (filter_key, address, state) VALUES %s ON CONFLICT DO NOTHING",
-                    [(filter_key, addr, state_type) for addr in addresses]
-                )
+                rows = [(filter_key, addr, state_type) for addr in addresses]
+                if len(rows) > COPY_MIN_ROWS:
+                    copy_filter_state_rows(cur, rows)
+                else:
+                    psycopg2.extras.execute_values(
+                        cur,
+                        "INSERT INTO filter_state (filter_key, address, state) VALUES %s ON CONFLICT DO NOTHING",
+                        rows,
+                        page_size=500,
+                    )
             conn.commit()
     except Exception as e:
         print(f"  [DB] db_save_filter_state error: {e}")
 
 
-def db_cleanup_seen_tokens(max_age_hours: float):
-    """Remove tokens older than max_age_hours from seen_tokens."""
+def state_rows(currently: set, expired: set) -> dict:
+    """address -> state for one filter, as stored in filter_state."""
+    rows = dict.fromkeys(expired, "expired")
+    rows.update(dict.fromkeys(currently, "currently"))
+    return rows
+
+
+def db_sync_filter_state(filter_key: str, saved: dict, rows: dict) -> bool:
+    """Write only the filter_state rows that differ from `saved` (what the DB
+    holds) in one round-trip and one transaction. Returns True on success."""
+    removed = [addr for addr in saved if addr not in rows]
+    changed = [(addr, st) for addr, st in rows.items() if saved.get(addr) != st]
+    if not removed and not changed:
+        return True
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                if len(changed) > COPY_MIN_ROWS:
+                    # Large resync (e.g. first cycle after a state reset)
+                    cur.execute("""
+                        DELETE FROM filter_state
+                        WHERE filter_key = %s AND address = ANY(%s::text[])
+                    """, (filter_key, removed))
+                    copy_filter_state_rows(cur, [(filter_key, addr, st) for addr, st in changed],
+                                           update=True)
+                    return True
+                cur.execute("""
+                    DELETE FROM filter_state
+                    WHERE filter_key = %(key)s AND address = ANY(%(removed)s::text[]);
+                    INSERT INTO filter_state (filter_key, address, state)
+                    SELECT %(key)s, t.address, t.state
+                    FROM unnest(%(addrs)s::text[], %(states)s::text[]) AS t(address, state)
+                    ON CONFLICT (filter_key, address) DO UPDATE SET state = EXCLUDED.state;
+                """, {
+                    "key":     filter_key,
+                    "removed": removed,
+                    "addrs":   [addr for addr, _ in changed],
+                    "states":  [st for _, st in changed],
+                })
+        return True
+    except Exception as e:
+        print(f"  [DB] db_sync_filter_state error: {e}")
+        return False
+
+
+def db_cleanup_seen_tokens(max_age_hours: float) -> set:
+    """Remove tokens older than max_age_hours from seen_tokens; returns the
+    removed addresses."""
     cutoff_ms = int(time.time() * 1000 - max_age_hours * 3600 * 1000)
     try:
         with get_conn() as conn:
@@ -171,41 +337,69 @@ def db_cleanup_seen_tokens(max_age_hours: float):
                 cur.execute("""
                     DELETE FROM seen_tokens
                     WHERE created_at_ms > 0 AND created_at_ms < %s
+                    RETURNING address
                 """, (cutoff_ms,))
-                removed = cur.rowcount
+                removed = {row[0] for row in cur.fetchall()}
             conn.commit()
         if removed:
-            print(f"  [DB] Cleaned up {removed} expired tokens from seen_tokens")
+            print(f"  [DB] Cleaned up {len(removed)} expired tokens from seen_tokens")
         return removed
     except Exception as e:
         print(f"  [DB] cleanup error: {e}")
-        return 0
+        return set()
 
 
 # ─── TELEGRAM ─────────────────────────────────────────────────────────────────
 
+def post_telegram(api_url: str, body: bytes):
+    """POST a sendMessage body, waiting out 429s as long as Telegram asks."""
+    for _ in range(TG_429_RETRIES):
+        r = SESSION.post(f"{api_url}/sendMessage", data=body, headers=JSON_BODY, timeout=10)
+        if r.status_code != 429:
+            return r
+        retry_after = orjson.loads(r.content).get("parameters", {}).get("retry_after", 1)
+        time.sleep(retry_after)
+    return SESSION.post(f"{api_url}/sendMessage", data=body, headers=JSON_BODY, timeout=10)
+
+
 def send_telegram(api_url: str, message: str):
     try:
-        r = requests.post(f"{api_url}/sendMessage", json={
+        r = post_telegram(api_url, orjson.dumps({
             "chat_id": CHAT_ID,
             "text": message,
             "parse_mode": "HTML",
             "disable_web_page_preview": True,
-        }, timeout=10)
+        }))
         if not r.ok:
-            print(f"  TG error {r.status_code}: {r.json().get('description')}")
-            requests.post(f"{api_url}/sendMessage", json={
+            print(f"  TG error {r.status_code}: {orjson.loads(r.content).get('description')}")
+        if r.status_code == 400:
+            # Usually an HTML parse error — resend as plain text
+            post_telegram(api_url, orjson.dumps({
                 "chat_id": CHAT_ID,
-                "text": re.sub(r"<[^>]+>", "", message),
+                "text": HTML_TAG_RE.sub("", message),
                 "disable_web_page_preview": True,
-            }, timeout=10)
+            }))
     except Exception as e:
         print(f"  TG error: {e}")
 
 
+def send_chunked(api_url: str, lines: list, sep: str = "\n", limit: int = 3800):
+    """Send lines joined by sep, split into messages of at most ~limit chars."""
+    buf, buf_len = [], 0
+    for line in lines:
+        ln = len(line) + len(sep)
+        if buf and buf_len + ln > limit:
+            send_telegram(api_url, sep.join(buf))
+            buf.clear()
+            buf_len = 0
+        buf.append(line)
+        buf_len += ln
+    if buf:
+        send_telegram(api_url, sep.join(buf))
+
+
 def handle_seen(api_url: str):
-    with lock:
-        tokens = list(seen_tokens_set)
+    tokens = seen_tokens_set
     total = len(tokens)
     if not total:
         send_telegram(api_url, "<b>No tokens tracked yet.</b>")
@@ -214,21 +408,11 @@ def handle_seen(api_url: str):
     lines = ["<b>Tracked: " + str(total) + " tokens</b>  |  <i>" + now + "</i>\n"]
     for i, addr in enumerate(tokens, 1):
         lines.append(str(i) + ". <code>" + addr + "</code>")
-    chunk = ""
-    for line in lines:
-        if len(chunk) + len(line) + 1 > 3800:
-            send_telegram(api_url, chunk)
-            chunk = line
-            time.sleep(0.3)
-        else:
-            chunk = chunk + "\n" + line if chunk else line
-    if chunk.strip():
-        send_telegram(api_url, chunk)
+    send_chunked(api_url, lines)
 
 
 def handle_missing(api_url: str):
-    with lock:
-        tokens = list(seen_tokens_set)
+    tokens = seen_tokens_set
     if not tokens:
         send_telegram(api_url, "<b>No tokens tracked yet.</b>")
         return
@@ -244,32 +428,21 @@ def handle_missing(api_url: str):
              "<i>(likely dead/rugged or not yet indexed)</i>"]
     for i, addr in enumerate(missing, 1):
         lines.append(str(i) + ". <code>" + addr + "</code>")
-    chunk = ""
-    for line in lines:
-        if len(chunk) + len(line) + 1 > 3800:
-            send_telegram(api_url, chunk)
-            chunk = line
-            time.sleep(0.3)
-        else:
-            chunk = chunk + "\n" + line if chunk else line
-    if chunk.strip():
-        send_telegram(api_url, chunk)
-
-
-def check_commands():
-    bots = [
-        ("f2",  TELEGRAM_API_F2,  F2),
-        ("f3",  TELEGRAM_API_F3,  F3),
-        ("new", TELEGRAM_API_NEW, None),
-    ]
-    for key, api_url, flt in bots:
+    send_chunked(api_url, lines)
+
+
+def poll_commands(key: str, api_url: str, flt):
+    """Long-poll getUpdates for one bot and dispatch its commands."""
+    while True:
         try:
-            r = requests.get(f"{api_url}/getUpdates",
-                             params={"offset": update_offsets.get(key, 0) + 1, "timeout": 0},
-                             timeout=10)
+            r = SESSION.get(f"{api_url}/getUpdates",
+                            params={"offset": update_offsets.get(key, 0) + 1,
+                                    "timeout": TG_POLL_TIMEOUT, "limit": 100},
+                            timeout=TG_POLL_TIMEOUT + 5)
             if not r.ok:
+                time.sleep(3)
                 continue
-            for update in r.json().get("result", []):
+            for update in orjson.loads(r.content).get("result", []):
                 update_offsets[key] = update["update_id"]
                 text = update.get("message", {}).get("text", "").strip().lower()
                 if text.startswith("/status") and flt:
@@ -280,30 +453,44 @@ def check_commands():
                     handle_seen(api_url)
         except Exception as e:
             print(f"  Command poll error ({key}): {e}")
+            time.sleep(3)
 
 
 def handle_status(api_url: str, flt: dict):
+    # Serve the last filter cycle's result (already sorted by MCap); only
+    # fetch live if no cycle has completed yet
     with lock:
-        tokens_to_check = list(seen_tokens_set)
+        snapshot = filter_state.get(flt["key"], {}).get("status")
 
-    if not tokens_to_check:
-        send_telegram(api_url, "📭 <b>No tokens tracked yet.</b>")
-        return
+    if snapshot:
+        passing, checked, checked_at = snapshot
+    else:
+        tokens_to_check = seen_tokens_set
 
-    send_telegram(api_url, f"⏳ Checking {len(tokens_to_check)} tokens, please wait...")
-    pairs = fetch_token_data(tokens_to_check)
-    if not pairs:
-        send_telegram(api_url, "⚠️ Could not fetch data from DexScreener.")
-        return
+        if not tokens_to_check:
+            send_telegram(api_url, "📭 <b>No tokens tracked yet.</b>")
+            return
+
+        send_telegram(api_url, f"⏳ Checking {len(tokens_to_check)} tokens, please wait...")
+        pairs = fetch_token_data(tokens_to_check)
+        if not pairs:
+            send_telegram(api_url, "⚠️ Could not fetch data from DexScreener.")
+            return
+
+        checked_at = time.time()
+        now_ms = checked_at * 1000
+        passing = sorted((p for p in pairs if passes_filter(p, flt, now_ms)),
+                         key=lambda p: p.get("marketCap") or 0, reverse=True)
+        checked = len(pairs)
 
-    passing = [p for p in pairs if passes_filter(p, flt)]
     if not passing:
         send_telegram(api_url,
             f"📭 <b>No tokens currently passing the filter.</b>\n"
-            f"Checked {len(pairs)} tokens.")
+            f"Checked {checked} tokens.")
         return
 
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    now = datetime.fromtimestamp(checked_at).strftime("%Y-%m-%d %H:%M:%S")
+    now_ms = time.time() * 1000
     lines = []
     for pair in passing:
         token_addr = pair.get("baseToken", {}).get("address", "?")
@@ -313,22 +500,14 @@ def handle_status(api_url: str, flt: dict):
         vol24  = pair.get("volume", {}).get("h24", 0)
         ds_url = pair.get("url", f"https://dexscreener.com/solana/{token_addr}")
         lines.append(
-            f"🪙 <b>{symbol}</b>  ({time_ago(pair.get('pairCreatedAt', 0))})\n"
+            f"🪙 <b>{symbol}</b>  ({time_ago(pair.get('pairCreatedAt', 0), now_ms)})\n"
             f"   MCap: {fmt_usd(mcap)}  |  24h: {fmt_pct(chg24)}  |  Vol: {fmt_usd(vol24)}\n"
             f"   <a href='{ds_url}'>DexScreener</a>\n"
             f"   <code>{token_addr}</code>"
         )
 
-    header = f"📊 <b>{flt['label']} — Status ({len(lines)})</b>\n{now}\n━━━━━━━━━━━━━━━━━━━━\n\n"
-    chunk = header
-    for line in lines:
-        if len(chunk) + len(line) > 3800:
-            send_telegram(api_url, chunk)
-            chunk = line + "\n\n"
-        else:
-            chunk += line + "\n\n"
-    if chunk.strip():
-        send_telegram(api_url, chunk)
+    header = f"📊 <b>{flt['label']} — Status ({len(lines)})</b>\n{now}\n━━━━━━━━━━━━━━━━━━━━"
+    send_chunked(api_url, [header] + lines, sep="\n\n")
 
 
 # ─── HELPERS ──────────────────────────────────────────────────────────────────
@@ -339,9 +518,10 @@ def esc(s: str) -> str:
 def fmt_usd(v): return f"${v:,.0f}" if v else "N/A"
 def fmt_pct(v): return f"+{v:.1f}%" if v and v > 0 else (f"{v:.1f}%" if v else "N/A")
 
-def time_ago(created_ms: int) -> str:
+def time_ago(created_ms: int, now_ms: float = None) -> str:
     if not created_ms: return "unknown"
-    secs = int(time.time() - created_ms / 1000)
+    if now_ms is None: now_ms = time.time() * 1000
+    secs = int((now_ms - created_ms) / 1000)
     if secs < 60:     return f"{secs}s ago"
     elif secs < 3600: return f"{secs//60}m ago"
     elif secs < 86400:
@@ -351,43 +531,100 @@ def time_ago(created_ms: int) -> str:
         d = secs // 86400; h = (secs % 86400) // 3600
         return f"{d}d {h}h ago" if h else f"{d}d ago"
 
-def age_hours(pair: dict) -> float:
+def age_hours(pair: dict, now_ms: float = None) -> float:
     created_ms = pair.get("pairCreatedAt", 0)
     if not created_ms: return 0
-    return (time.time() * 1000 - created_ms) / 3_600_000
-
-def fetch_token_data(token_addresses: list) -> list:
-    all_pairs = []
-    headers = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
-    for i in range(0, len(token_addresses), 30):
-        batch = token_addresses[i:i+30]
-        url = DEXSCREENER_API.format(",".join(batch))
-        try:
-            r = requests.get(url, headers=headers, timeout=15)
-            if r.ok:
-                pairs = r.json().get("pairs") or []
-                filtered = [p for p in pairs
-                            if p.get("chainId") == "solana"
-                            and "pump" in p.get("dexId", "").lower()]
-                if not filtered and pairs:
-                    filtered = [p for p in pairs if p.get("chainId") == "solana"]
-                all_pairs.extend(filtered)
-        except Exception as e:
-            print(f"  [API] exception: {e}")
-        time.sleep(0.3)
-    return all_pairs
-
-def passes_filter(pair: dict, flt: dict) -> bool:
-    mcap  = pair.get("marketCap", 0) or 0
-    vol   = pair.get("volume", {}).get("h24", 0) or 0
-    chg   = pair.get("priceChange", {}).get("h24", 0) or 0
-    age_h = age_hours(pair)
-    return (
-        flt["min_mcap"]  <= mcap  <= flt["max_mcap"] and
-        flt["min_age_h"] <= age_h <= flt["max_age_h"] and
-        vol >= flt["min_vol"] and
-        chg >= flt["min_chg"]
-    )
+    if now_ms is None: now_ms = time.time() * 1000
+    return (now_ms - created_ms) / 3_600_000
+
+def wait_dex_slot():
+    """Block until the shared DexScreener token bucket has a request to spend."""
+    rate = DEXSCREENER_RPM / 60
+    while True:
+        with dex_bucket_lock:
+            now = time.monotonic()
+            dex_bucket["tokens"] = min(DEXSCREENER_BURST,
+                                       dex_bucket["tokens"] + (now - dex_bucket["at"]) * rate)
+            dex_bucket["at"] = now
+            if dex_bucket["tokens"] >= 1:
+                dex_bucket["tokens"] -= 1
+                return
+            delay = (1 - dex_bucket["tokens"]) / rate
+        time.sleep(delay)
+
+def is_pump_dex(dex_id) -> bool:
+    # dexIds are almost always lowercase already; only lower() on a miss
+    return bool(dex_id) and ("pump" in dex_id or "pump" in dex_id.lower())
+
+def fetch_batch(batch: list) -> dict:
+    """Fetch one batch; returns {mint: [pairs]} for every mint in it, {} on error."""
+    url = DEXSCREENER_API.format(",".join(batch))
+    try:
+        wait_dex_slot()
+        r = SESSION.get(url, timeout=15)
+        if r.ok:
+            pairs = orjson.loads(r.content).get("pairs") or []
+            filtered = [p for p in pairs
+                        if p.get("chainId") == "solana" and is_pump_dex(p.get("dexId"))]
+            if not filtered and pairs:
+                filtered = [p for p in pairs if p.get("chainId") == "solana"]
+            by_mint = {mint: [] for mint in batch}
+            for p in filtered:
+                mint = (p.get("baseToken") or {}).get("address")
+                if mint in by_mint:
+                    by_mint[mint].append(p)
+            return by_mint
+    except Exception as e:
+        print(f"  [API] exception: {e}")
+    return {}
+
+def fetch_token_data(token_addresses: list, failed: set = None) -> list:
+    """Pairs for the given mints. Mints whose batch request failed (as opposed
+    to returning no pairs) are added to `failed` when a set is passed."""
+    # Drop repeats (order-preserving) so no batch slot is spent twice
+    token_addresses = list(dict.fromkeys(token_addresses))
+
+    # F2, F3 and commands ask for the same mints within seconds of each
+    # other — serve recent results from the cache, fetch only the rest
+    now = time.time()
+    by_mint = {}
+    with pairs_cache_lock:
+        for mint in token_addresses:
+            hit = pairs_cache.get(mint)
+            if hit and now - hit[0] < PAIRS_CACHE_TTL:
+                by_mint[mint] = hit[1]
+    stale = [mint for mint in token_addresses if mint not in by_mint]
+
+    batches = [stale[i:i+DEXSCREENER_BATCH]
+               for i in range(0, len(stale), DEXSCREENER_BATCH)]
+    # Batches are independent I/O — fetch them concurrently over the shared
+    # session; request rate is capped by the dex_bucket in fetch_batch
+    fresh = {}
+    for batch, result in zip(batches, fetch_pool.map(fetch_batch, batches)):
+        if not result and failed is not None:
+            failed.update(batch)
+        fresh.update(result)
+
+    fetched_at = time.time()
+    with pairs_cache_lock:
+        for mint in [m for m, (t, _) in pairs_cache.items() if fetched_at - t >= PAIRS_CACHE_TTL]:
+            del pairs_cache[mint]
+        for mint, mint_pairs in fresh.items():
+            pairs_cache[mint] = (fetched_at, mint_pairs)
+    by_mint.update(fresh)
+    return [p for mint in token_addresses for p in by_mint.get(mint, ())]
+
+def passes_filter(pair: dict, flt: dict, now_ms: float = None) -> bool:
+    # Cheapest tests first; most pairs fail on MCap and never reach the
+    # age computation
+    mcap = pair.get("marketCap") or 0
+    if not flt["min_mcap"] <= mcap <= flt["max_mcap"]:
+        return False
+    vol = (pair.get("volume") or {}).get("h24") or 0
+    chg = (pair.get("priceChange") or {}).get("h24") or 0
+    if vol < flt["min_vol"] or chg < flt["min_chg"]:
+        return False
+    return flt["min_age_h"] <= age_hours(pair, now_ms) <= flt["max_age_h"]
 
 def build_alert_ch1(token: dict) -> str:
     symbol      = esc(token.get("symbol", "?"))
@@ -453,12 +690,10 @@ def build_alert_ch2(pair: dict, label: str = "💎 Gem Alert") -> str:
 def fetch_token_meta(mint: str, retries: int = 6, delay: float = 5.0) -> dict:
     for attempt in range(retries):
         try:
-            r = requests.get(
-                f"https://api.dexscreener.com/latest/dex/tokens/{mint}",
-                headers={"User-Agent": "Mozilla/5.0"}, timeout=10
-            )
+            wait_dex_slot()
+            r = SESSION.get(DEXSCREENER_API.format(mint), timeout=10)
             if r.ok:
-                pairs = r.json().get("pairs") or []
+                pairs = orjson.loads(r.content).get("pairs") or []
                 for pair in sorted(pairs, key=lambda p: p.get("dexId", "") != "pumpswap"):
                     base = pair.get("baseToken", {})
                     if base.get("symbol") and base.get("name"):
@@ -478,36 +713,48 @@ def fetch_token_meta(mint: str, retries: int = 6, delay: float = 5.0) -> dict:
 
 def on_ws_open(ws):
     print("  [WS] Connected to PumpPortal")
-    ws.send(json.dumps({"method": "subscribeMigration"}))
+    ws.send(orjson.dumps({"method": "subscribeMigration"}).decode())
 
 def on_ws_message(ws, message):
+    global seen_tokens_set
     try:
-        data = json.loads(message)
+        data = orjson.loads(message)
         mint = data.get("mint") or data.get("token") or data.get("address")
         if not mint: return
 
+        # Claim the mint now so repeat events are dropped, and hand it to a
+        # worker — the meta retry loop can take 30s and must not stall the
+        # WebSocket receive thread
         with lock:
-            already_seen = mint in seen_tokens_set
-        if already_seen: return
-
-        # Fetch meta (with retry)
-        meta = fetch_token_meta(mint)
-        data["symbol"]     = meta["symbol"]
-        data["name"]       = meta["name"]
-        data["created_ms"] = meta["created_ms"]
-        data["mint"]       = mint
-
-        # Add to DB and in-memory set
-        db_add_seen_token(mint, meta["created_ms"])
-        with lock:
-            seen_tokens_set.add(mint)
-
-        print(f"  [GRADUATED] {data['symbol']:12} | {mint}")
-        send_telegram(TELEGRAM_API_NEW, build_alert_ch1(data))
+            if mint in seen_tokens_set: return
+            seen_tokens_set = seen_tokens_set | {mint}
+        graduation_queue.put((mint, data))
 
     except Exception as e:
         print(f"  [WS] Message error: {e}")
 
+def graduation_worker():
+    while True:
+        mint, data = graduation_queue.get()
+        try:
+            # Fetch meta (with retry)
+            meta = fetch_token_meta(mint)
+            data["symbol"]     = meta["symbol"]
+            data["name"]       = meta["name"]
+            data["created_ms"] = meta["created_ms"]
+            data["mint"]       = mint
+
+            # Add to DB (already in the in-memory set); the insert itself is
+            # the authoritative duplicate check
+            if not db_add_seen_token(mint, meta["created_ms"]):
+                continue
+
+            print(f"  [GRADUATED] {data['symbol']:12} | {mint}")
+            send_telegram(TELEGRAM_API_NEW, build_alert_ch1(data))
+
+        except Exception as e:
+            print(f"  [WS] Graduation worker error: {e}")
+
 def on_ws_error(ws, error):
     print(f"  [WS] Error: {error}")
 
@@ -532,15 +779,15 @@ def start_websocket():
 def initial_scan(key: str, flt: dict):
     """Pre-populate state["currently"] on startup to avoid re-alerting."""
     state = filter_state[key]
-    with lock:
-        all_tokens = list(seen_tokens_set)
+    all_tokens = seen_tokens_set
     if not all_tokens:
         return
     print(f"  [{key.upper()}] Initial scan of {len(all_tokens)} tokens...")
     pairs = fetch_token_data(all_tokens)
+    now_ms = time.time() * 1000
     for pair in pairs:
         addr = (pair.get("baseToken") or {}).get("address")
-        if addr and passes_filter(pair, flt):
+        if addr and passes_filter(pair, flt, now_ms):
             state["currently"].add(addr)
     # Persist to DB
     db_save_filter_state(key, "currently", state["currently"])
@@ -559,51 +806,75 @@ def filter_loop_for(key: str, api_url: str, flt: dict, initial_delay: float = 0)
     while True:
         time.sleep(FILTER_POLL_SEC)
         try:
-            with lock:
-                all_tokens = list(seen_tokens_set)
-
-            tokens_to_check = [t for t in all_tokens if t not in state["expired"]]
-            pairs = fetch_token_data(tokens_to_check) if tokens_to_check else []
+            tokens_to_check = [t for t in seen_tokens_set if t not in state["expired"]]
+            failed = set()
+            pairs = fetch_token_data(tokens_to_check, failed) if tokens_to_check else []
 
-            new_passing = set()
+            passing_by_addr = {}   # token -> first passing pair, for alerts
+            matching = []
+            now_ms = time.time() * 1000   # one clock read for the whole cycle
             for pair in pairs:
-                token_addr = pair.get("baseToken", {}).get("address", "?")
-                age_h = age_hours(pair)
+                token_addr = (pair.get("baseToken") or {}).get("address", "?")
+                age_h = age_hours(pair, now_ms)
                 if age_h > flt["max_age_h"]:
                     state["expired"].add(token_addr)
                     continue
-                if passes_filter(pair, flt):
-                    new_passing.add(token_addr)
+                if passes_filter(pair, flt, now_ms):
+                    passing_by_addr.setdefault(token_addr, pair)
+                    matching.append(pair)
+            new_passing = set(passing_by_addr)
+            # A failed fetch says nothing about a token — keep its previous
+            # state so it doesn't drop out and re-alert next cycle
+            new_passing |= state["currently"] & failed
+
+            # Publish for /status — sorted once here instead of per command.
+            # An empty fetch for a non-empty token list means DexScreener
+            # failed; keep the last good snapshot rather than report "0 checked"
+            if pairs or not tokens_to_check:
+                matching.sort(key=lambda p: p.get("marketCap") or 0, reverse=True)
+                with lock:
+                    state["status"] = (tuple(matching), len(pairs), time.time())
 
             just_entered = new_passing - state["currently"]
             if just_entered:
                 print(f"  [{key.upper()}] {len(new_passing)} passing, {len(just_entered)} just entered")
 
+            sends = []
             for token_addr in just_entered:
-                pair = next((p for p in pairs
-                             if p.get("baseToken", {}).get("address") == token_addr), None)
-                if not pair: continue
-                symbol = pair.get("baseToken", {}).get("symbol", "?")
+                pair = passing_by_addr[token_addr]
+                symbol = (pair.get("baseToken") or {}).get("symbol", "?")
                 print(f"  [{key.upper()}] ALERT: {symbol:12} | {token_addr}")
-                send_telegram(api_url, build_alert_ch2(pair, label=flt["label"]))
+                sends.append(tg_pool.submit(send_telegram, api_url, build_alert_ch2(pair, label=flt["label"])))
+            # Alerts must be out before state is persisted as "currently"
+            wait(sends)
 
             state["currently"] = new_passing
 
             # Persist state to DB every cycle so restarts don't re-alert
-            db_save_filter_state(key, "currently", state["currently"])
-            db_save_filter_state(key, "expired",   state["expired"])
-
-            # Cleanup seen_tokens older than max_age + 48h buffer
-            db_cleanup_seen_tokens(flt["max_age_h"] + 48)
-            # Sync in-memory set after cleanup
-            with lock:
-                seen_tokens_set.clear()
-                seen_tokens_set.update(db_load_seen_tokens())
+            rows = state_rows(state["currently"], state["expired"])
+            if db_sync_filter_state(key, state["saved"], rows):
+                state["saved"] = rows
+            # Forget expired entries for tokens cleanup_loop removed
+            state["expired"].intersection_update(seen_tokens_set)
 
         except Exception as e:
             print(f"  [{key.upper()}] Error: {e}")
 
 
+# ─── CLEANUP ─────────────────────────────────────────────────────────────────
+
+def cleanup_loop():
+    """At startup, then hourly: drop seen_tokens older than the longest filter window + 48h."""
+    global seen_tokens_set
+    max_age_h = max(F2["max_age_h"], F3["max_age_h"]) + 48
+    while True:
+        removed = db_cleanup_seen_tokens(max_age_h)
+        if removed:
+            with lock:
+                seen_tokens_set = seen_tokens_set - removed
+        time.sleep(CLEANUP_INTERVAL_SEC)
+
+
 # ─── MAIN ─────────────────────────────────────────────────────────────────────
 
 def main():
@@ -627,7 +898,7 @@ def main():
     init_db()
 
     # Load seen tokens from DB into memory
-    seen_tokens_set = db_load_seen_tokens()
+    seen_tokens_set = frozenset(db_load_seen_tokens())
     print(f"\n📂 Loaded {len(seen_tokens_set)} tokens from DB")
 
     # Load persisted filter state from DB
@@ -648,13 +919,21 @@ def main():
     if not filter_state["f3"]["currently"] and not filter_state["f3"]["expired"]:
         initial_scan("f3", F3)
 
-    # Start WebSocket (Bot 1)
+    # Remember what the DB holds so each cycle only writes the difference
+    for key in ("f2", "f3"):
+        state = filter_state[key]
+        state["saved"] = state_rows(state["currently"], state["expired"])
+
+    # Start WebSocket (Bot 1) and the workers that process its graduations
+    for _ in range(META_WORKERS):
+        threading.Thread(target=graduation_worker, daemon=True).start()
     print("\n🔌 Connecting to PumpSwap WebSocket...")
     start_websocket()
 
     # Start filter threads — staggered by half interval
     threading.Thread(target=filter_loop_for, args=("f2", TELEGRAM_API_F2, F2), kwargs={"initial_delay": 0}, daemon=True).start()
     threading.Thread(target=filter_loop_for, args=("f3", TELEGRAM_API_F3, F3), kwargs={"initial_delay": FILTER_POLL_SEC / 2}, daemon=True).start()
+    threading.Thread(target=cleanup_loop, daemon=True).start()
 
     # Startup pings
     send_telegram(TELEGRAM_API_NEW,
@@ -675,11 +954,19 @@ def main():
     send_telegram(TELEGRAM_API_F2, flt_msg(F2))
     send_telegram(TELEGRAM_API_F3, flt_msg(F3))
 
+    # Command pollers — one long-poll thread per bot so a slow command on one
+    # bot doesn't hold up the others
+    for key, api_url, flt in [
+        ("f2",  TELEGRAM_API_F2,  F2),
+        ("f3",  TELEGRAM_API_F3,  F3),
+        ("new", TELEGRAM_API_NEW, None),
+    ]:
+        threading.Thread(target=poll_commands, args=(key, api_url, flt), daemon=True).start()
+
     print("\n✅ Running. Press Ctrl+C to stop.\n")
     while True:
         try:
-            check_commands()
-            time.sleep(3)
+            time.sleep(1)
         except KeyboardInterrupt:
             print("\n👋 Stopped.")
             break